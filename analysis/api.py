@@ -1,29 +1,87 @@
 """FastAPI server for analysis worker - called by NestJS."""
 
+import asyncio
+import uuid
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from typing import List, Dict, Any, Optional
 from datetime import datetime
-from fastapi import FastAPI, HTTPException, BackgroundTasks
+from fastapi import FastAPI, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
 import uvicorn
 
-from worker import HypothesisWorker
+from worker import init_process_worker, run_hypothesis_job, run_all_pending_job
 from stats import StatisticalAnalyzer
-from sentiment import SentimentAnalyzer
+from database import Database
+from sentiment import get_analyzer
+from batcher import DynamicBatcher
 from config import Config
 
 app = FastAPI(title="Skynet Analysis Worker", version="1.0.0")
 
 # Initialize workers
-worker = HypothesisWorker()
 stats = StatisticalAnalyzer()
-_sentiment = None
+db = Database()
 
 
-def get_sentiment():
-    global _sentiment
-    if _sentiment is None:
-        _sentiment = SentimentAnalyzer()
-    return _sentiment
+# Preloading at import time lets forked workers (gunicorn --preload, the
+# hypothesis process pool) share the files, and CPU torch weights copy-on-write
+if Config.PRELOAD_MODEL:
+    get_analyzer().preload()
+
+
+# Concurrent /sentiment/analyze and /sentiment/aggregate requests share one
+# forward pass
+sentiment_batcher = DynamicBatcher(
+    lambda texts: get_analyzer().predict_proba(texts),
+    max_wait_ms=Config.SENTIMENT_MAX_WAIT_MS,
+    max_batch_size=Config.SENTIMENT_MAX_BATCH,
+)
+
+
+@app.on_event("startup")
+async def start_batcher():
+    sentiment_batcher.start()
+
+
+@app.on_event("shutdown")
+async def stop_batcher():
+    await sentiment_batcher.stop()
+
+
+# Hypothesis tests run in worker processes so CPU-bound stats never block
+# the event loop. Progress is read back from the hypotheses table, which
+# every API worker process can see.
+executor: Optional[ProcessPoolExecutor] = None
+
+
+def start_pool() -> ProcessPoolExecutor:
+    return ProcessPoolExecutor(max_workers=Config.NUM_WORKERS, initializer=init_process_worker)
+
+
+@app.on_event("startup")
+async def start_executor():
+    global executor
+    executor = start_pool()
+
+
+@app.on_event("shutdown")
+async def stop_executor():
+    if executor is not None:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def submit_job(fn, *args) -> Future:
+    global executor
+    try:
+        return executor.submit(fn, *args)
+    except BrokenProcessPool:
+        # One dead pool process (e.g. OOM-killed) breaks the whole executor;
+        # replace it rather than failing every later job
+        executor.shutdown(wait=False, cancel_futures=True)
+        executor = start_pool()
+        return executor.submit(fn, *args)
 
 
 # Request/Response models
@@ -57,11 +115,10 @@ def health_check():
 
 
 @app.post("/hypothesis/run")
-async def run_hypothesis(request: HypothesisRequest, background_tasks: BackgroundTasks):
+async def run_hypothesis(request: HypothesisRequest):
     """Queue a hypothesis for testing."""
     try:
-        # Run in background to avoid timeout
-        background_tasks.add_task(worker.run_hypothesis, request.hypothesis_id)
+        submit_job(run_hypothesis_job, request.hypothesis_id)
         return {"status": "queued", "hypothesis_id": request.hypothesis_id}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -69,27 +126,47 @@ async def run_hypothesis(request: HypothesisRequest, background_tasks: Backgroun
 
 @app.post("/hypothesis/run-sync")
 async def run_hypothesis_sync(request: HypothesisRequest):
-    """Run hypothesis synchronously (blocking)."""
+    """Run hypothesis and wait for the result."""
     try:
-        result = worker.run_hypothesis(request.hypothesis_id)
+        result = await asyncio.wrap_future(submit_job(run_hypothesis_job, request.hypothesis_id))
         return {"status": "completed", "result": result}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.post("/hypothesis/run-all")
-async def run_all_pending(background_tasks: BackgroundTasks):
+async def run_all_pending():
     """Run all pending hypotheses."""
-    background_tasks.add_task(worker.run_all_pending)
+    submit_job(run_all_pending_job)
     return {"status": "queued"}
 
 
+@app.get("/hypothesis/status/{hypothesis_id}")
+async def hypothesis_status(hypothesis_id: str):
+    """Poll a queued hypothesis."""
+    try:
+        uuid.UUID(hypothesis_id)
+    except ValueError:
+        raise HTTPException(status_code=404, detail=f"Unknown hypothesis: {hypothesis_id}")
+    row = await run_in_threadpool(db.get_hypothesis_status, hypothesis_id)
+    if row is None:
+        raise HTTPException(status_code=404, detail=f"Unknown hypothesis: {hypothesis_id}")
+
+    status = {"hypothesis_id": hypothesis_id, "status": row["status"]}
+    if row["status"] == "failed":
+        status["error"] = row["error_message"]
+    elif row["status"] == "completed":
+        status["result"] = row["test_results"]
+    return status
+
+
 @app.post("/stats/correlation")
 async def correlation_test(request: CorrelationRequest):
     """Run correlation test on provided data."""
     try:
         import numpy as np
-        result = stats.correlation_test(
+        result = await run_in_threadpool(
+            stats.correlation_test,
             np.array(request.x),
             np.array(request.y),
             request.method,
@@ -104,7 +181,8 @@ async def granger_test(request: CorrelationRequest):
     """Run Granger causality test."""
     try:
         import numpy as np
-        result = stats.granger_causality_test(
+        result = await run_in_threadpool(
+            stats.granger_causality_test,
             np.array(request.x),
             np.array(request.y),
         )
@@ -117,11 +195,12 @@ async def granger_test(request: CorrelationRequest):
 async def analyze_sentiment(request: SentimentRequest):
     """Analyze sentiment of texts using FinBERT."""
     try:
-        sentiment = get_sentiment()
+        probs = await sentiment_batcher.submit(request.texts)
+        sentiment = get_analyzer()
         if len(request.texts) == 1:
-            result = sentiment.analyze(request.texts[0])
+            result = sentiment.format_result(probs[0])
         else:
-            result = sentiment.analyze_batch(request.texts)
+            result = sentiment.format_batch(request.texts, probs)
         return {"results": result}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -131,9 +210,12 @@ async def analyze_sentiment(request: SentimentRequest):
 async def aggregate_sentiment(request: SentimentRequest):
     """Get aggregate sentiment statistics."""
     try:
-        sentiment = get_sentiment()
-        result = sentiment.aggregate_sentiment(request.texts)
-        return result
+        # Through the batcher, so aggregate calls share forward passes with
+        # /sentiment/analyze instead of competing with them for CPU threads
+        if not request.texts:
+            return get_analyzer().aggregate_sentiment([])
+        probs = await sentiment_batcher.submit(request.texts)
+        return get_analyzer().format_aggregate(probs)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
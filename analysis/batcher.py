@@ -0,0 +1,97 @@
+"""Dynamic batching of concurrent inference requests."""
+
+import asyncio
+from typing import Callable, List, Optional, Tuple
+import numpy as np
+
+
+class DynamicBatcher:
+    """Coalesce concurrent requests into a single model call.
+
+    Requests queue up for at most `max_wait_ms` (or until `max_batch_size`
+    texts are pending), run through `fn` as one batch in the default
+    executor, and each caller gets back its own slice of the result rows.
+    """
+
+    def __init__(
+        self,
+        fn: Callable[[List[str]], np.ndarray],
+        max_wait_ms: float = 5,
+        max_batch_size: int = 256,
+    ):
+        self.fn = fn
+        self.max_wait = max_wait_ms / 1000
+        self.max_batch_size = max_batch_size
+        self._queue: "asyncio.Queue[Tuple[List[str], asyncio.Future]]" = asyncio.Queue()
+        self._task: Optional[asyncio.Task] = None
+        # Requests taken off the queue whose batch has not finished yet
+        self._inflight: List[Tuple[List[str], asyncio.Future]] = []
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop batching and fail every request still waiting on a result."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        error = RuntimeError("Batcher stopped")
+        _fail(self._inflight, error)
+        self._inflight = []
+        while not self._queue.empty():
+            _fail([self._queue.get_nowait()], error)
+
+    async def submit(self, texts: List[str]) -> np.ndarray:
+        """Queue texts for the next batch and wait for their result rows."""
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((texts, future))
+        return await future
+
+    async def _run(self) -> None:
+        while True:
+            self._inflight = [await self._queue.get()]
+            try:
+                await self._run_batch(self._inflight)
+            except Exception as e:
+                # Fail this batch's callers and keep serving the next one
+                _fail(self._inflight, e)
+            self._inflight = []
+
+    async def _run_batch(self, pending: List[Tuple[List[str], asyncio.Future]]) -> None:
+        """Fill `pending` up to the size or wait limit, then run it through `fn`."""
+        loop = asyncio.get_running_loop()
+        size = len(pending[0][0])
+        deadline = loop.time() + self.max_wait
+
+        while size < self.max_batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(self._queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            pending.append(item)
+            size += len(item[0])
+
+        texts = [text for batch, _ in pending for text in batch]
+        rows = await loop.run_in_executor(None, self.fn, texts)
+
+        offset = 0
+        for batch, future in pending:
+            if not future.done():
+                future.set_result(rows[offset : offset + len(batch)])
+            offset += len(batch)
+
+
+def _fail(pending: List[Tuple[List[str], asyncio.Future]], error: Exception) -> None:
+    """Set `error` on every future in `pending` that is still waiting."""
+    for _, future in pending:
+        if not future.done():
+            future.set_exception(error)
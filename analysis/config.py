@@ -14,9 +14,14 @@ class Config:
     DB_USER = os.getenv("DB_USERNAME", "postgres")
     DB_PASSWORD = os.getenv("DB_PASSWORD", "postgres")
 
+    DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+    DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+    DB_FETCH_SIZE = int(os.getenv("DB_FETCH_SIZE", "50000"))
+    RESULTS_BATCH_SIZE = int(os.getenv("RESULTS_BATCH_SIZE", "100"))
+
     @classmethod
     def get_db_url(cls) -> str:
-        return f"postgresql://{cls.DB_USER}:{cls.DB_PASSWORD}@{cls.DB_HOST}:{cls.DB_PORT}/{cls.DB_NAME}"
+        return f"postgresql+psycopg://{cls.DB_USER}:{cls.DB_PASSWORD}@{cls.DB_HOST}:{cls.DB_PORT}/{cls.DB_NAME}"
 
     # Analysis settings
     MIN_SAMPLE_SIZE = int(os.getenv("MIN_SAMPLE_SIZE", "30"))
@@ -26,7 +31,16 @@ class Config:
     # NLP settings
     SENTIMENT_MODEL = os.getenv("SENTIMENT_MODEL", "ProsusAI/finbert")
     USE_GPU = os.getenv("USE_GPU", "false").lower() == "true"
+    SENTIMENT_DTYPE = os.getenv("SENTIMENT_DTYPE", "auto")  # "auto", "fp32", "fp16", "bf16" or "int8"
+    TORCH_COMPILE = os.getenv("TORCH_COMPILE", "false").lower() == "true"
+    SENTIMENT_CACHE_SIZE = int(os.getenv("SENTIMENT_CACHE_SIZE", "50000"))
+    SENTIMENT_MAX_WAIT_MS = float(os.getenv("SENTIMENT_MAX_WAIT_MS", "5"))
+    SENTIMENT_MAX_BATCH = int(os.getenv("SENTIMENT_MAX_BATCH", "256"))
+    SENTIMENT_BACKEND = os.getenv("SENTIMENT_BACKEND", "torch")  # "torch" or "onnx"
+    PRELOAD_MODEL = os.getenv("PRELOAD_MODEL", "false").lower() == "true"
+    MODEL_CACHE_DIR = os.getenv("MODEL_CACHE_DIR", ".model_cache")
 
     # API settings
     API_HOST = os.getenv("ANALYSIS_API_HOST", "0.0.0.0")
     API_PORT = int(os.getenv("ANALYSIS_API_PORT", "8001"))
+    NUM_WORKERS = int(os.getenv("NUM_WORKERS", str(os.cpu_count() or 1)))
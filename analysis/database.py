@@ -1,19 +1,128 @@
 """Database connection and queries for analysis."""
 
+import json
 from datetime import datetime
-from typing import List, Optional, Dict, Any
+from typing import Iterator, List, Optional, Dict, Any
+import numpy as np
 import pandas as pd
-from sqlalchemy import create_engine, text
+from sqlalchemy import bindparam, create_engine, text
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import sessionmaker
 
 from config import Config
 
+# Fixed statements are built once so SQLAlchemy's compiled cache hits on every call
+GET_HYPOTHESIS = text("SELECT * FROM hypotheses WHERE id = :id")
+
+GET_HYPOTHESIS_STATUS = text("""
+    SELECT id::text AS id, status::text AS status, error_message, test_results
+    FROM hypotheses
+    WHERE id = :id
+""")
+
+# Ordered so hypotheses over the same events and prices arrive together, and
+# each asset's longest lookback loads first for shorter ones to reuse
+GET_PENDING_HYPOTHESES = text("""
+    SELECT id::text AS id, event_type, market_asset, test_type, lookback_days
+    FROM hypotheses
+    WHERE status = 'pending'
+    ORDER BY market_asset, event_type, lookback_days DESC, created_at ASC
+""")
+
+UPDATE_HYPOTHESIS_RESULTS = text("""
+    UPDATE hypotheses
+    SET status = 'completed',
+        p_value = :p_value,
+        hit_rate = :hit_rate,
+        edge = :edge,
+        sample_size = :sample_size,
+        test_results = :test_results,
+        tested_at = NOW()
+    WHERE id = :id
+""").bindparams(bindparam("test_results", type_=JSONB))
+
+MARK_HYPOTHESIS_FAILED = text("""
+    UPDATE hypotheses
+    SET status = 'failed',
+        error_message = :error,
+        tested_at = NOW()
+    WHERE id = :id
+""")
+
+CREATE_RELATIONSHIP = text("""
+    INSERT INTO relationships
+    (event_type, market_asset, hit_rate, edge, p_value, sample_size,
+     description, metadata, is_significant)
+    VALUES
+    (:event_type, :market_asset, :hit_rate, :edge, :p_value, :sample_size,
+     :description, :metadata, :is_significant)
+    RETURNING id::text
+""").bindparams(bindparam("metadata", type_=JSONB))
+
+
+# Calendar day of a timestamptz in UTC, independent of the session time zone
+UTC_DATE = "(timestamp AT TIME ZONE 'UTC')::date"
+
+
+def _json_default(value: Any) -> Any:
+    """Serialize the NumPy scalars and arrays that stats results contain."""
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _finite(value: Any) -> Any:
+    """Replace NaN/inf floats with None; Postgres rejects them in jsonb."""
+    if isinstance(value, dict):
+        return {key: _finite(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return [_finite(item) for item in value]
+    if isinstance(value, (float, np.floating)):
+        return float(value) if np.isfinite(value) else None
+    return value
+
+
+def _json_dumps(value: Any) -> str:
+    # allow_nan=False so anything _finite missed fails here, not in Postgres
+    return json.dumps(_finite(value), default=_json_default, allow_nan=False)
+
 
 class Database:
     def __init__(self):
-        self.engine = create_engine(Config.get_db_url())
+        # psycopg 3 prepares statements server-side once per pooled connection
+        self.engine = create_engine(
+            Config.get_db_url(),
+            pool_pre_ping=True,
+            pool_size=Config.DB_POOL_SIZE,
+            max_overflow=Config.DB_MAX_OVERFLOW,
+            connect_args={"prepare_threshold": 0},
+            json_serializer=_json_dumps,
+        )
         self.Session = sessionmaker(bind=self.engine)
 
+    def _read_frame(
+        self, query: str, params: Dict[str, Any], parse_dates: Optional[List[str]] = None
+    ) -> pd.DataFrame:
+        """Read a query into a DataFrame through a server-side cursor.
+
+        Rows are fetched and converted in chunks of DB_FETCH_SIZE, so the
+        driver never buffers the full result set as Python tuples.
+        `parse_dates` columns come back as datetime64 (UTC for timestamptz).
+        """
+        with self.engine.connect() as conn:
+            conn = conn.execution_options(stream_results=True)
+            chunks = pd.read_sql(
+                text(query),
+                conn,
+                params=params,
+                parse_dates=parse_dates,
+                chunksize=Config.DB_FETCH_SIZE,
+            )
+            df = pd.concat(chunks, ignore_index=True)
+        return df
+
     def get_events(
         self,
         source: Optional[str] = None,
@@ -21,9 +130,19 @@ class Database:
         entity: Optional[str] = None,
         start_date: Optional[datetime] = None,
         end_date: Optional[datetime] = None,
+        group_by_day: bool = False,
     ) -> pd.DataFrame:
-        """Get events as a DataFrame."""
-        query = "SELECT * FROM events WHERE 1=1"
+        """Get events as a DataFrame.
+
+        With `group_by_day`, Postgres aggregates instead: one row per UTC
+        date with the mean event `value` and the event `count`.
+        """
+        if group_by_day:
+            query = f"""
+                SELECT {UTC_DATE} AS date, AVG(value)::float8 AS value, COUNT(id) AS count
+                FROM events WHERE 1=1"""
+        else:
+            query = "SELECT * FROM events WHERE 1=1"
         params: Dict[str, Any] = {}
 
         if source:
@@ -42,20 +161,33 @@ class Database:
             query += " AND timestamp <= :end_date"
             params["end_date"] = end_date
 
+        if group_by_day:
+            query += " GROUP BY 1 ORDER BY 1"
+            return self._read_frame(query, params, parse_dates=["date"])
+
         query += " ORDER BY timestamp ASC"
 
-        with self.engine.connect() as conn:
-            df = pd.read_sql(text(query), conn, params=params)
-        return df
+        return self._read_frame(query, params, parse_dates=["timestamp"])
 
     def get_market_data(
         self,
         asset: str,
         start_date: Optional[datetime] = None,
         end_date: Optional[datetime] = None,
+        group_by_day: bool = False,
     ) -> pd.DataFrame:
-        """Get market data as a DataFrame."""
-        query = "SELECT * FROM market_data WHERE asset = :asset"
+        """Get market data as a DataFrame.
+
+        With `group_by_day`, Postgres aggregates instead: one row per UTC
+        date with that day's last non-null `close`.
+        """
+        if group_by_day:
+            query = f"""
+                SELECT {UTC_DATE} AS date, close::float8 AS close,
+                       LEAD({UTC_DATE}) OVER (ORDER BY timestamp) AS next_date
+                FROM market_data WHERE asset = :asset AND close IS NOT NULL"""
+        else:
+            query = "SELECT * FROM market_data WHERE asset = :asset"
         params: Dict[str, Any] = {"asset": asset}
 
         if start_date:
@@ -65,22 +197,48 @@ class Database:
             query += " AND timestamp <= :end_date"
             params["end_date"] = end_date
 
+        if group_by_day:
+            # The window walks the (asset, timestamp) index in order, so each
+            # day's last close is just the row before the date changes; no
+            # per-day sort or hash aggregate
+            query = f"""
+                SELECT date, close FROM ({query}) closes
+                WHERE next_date IS DISTINCT FROM date
+                ORDER BY date"""
+            return self._read_frame(query, params, parse_dates=["date"])
+
         query += " ORDER BY timestamp ASC"
 
-        with self.engine.connect() as conn:
-            df = pd.read_sql(text(query), conn, params=params)
-        return df
+        return self._read_frame(query, params, parse_dates=["timestamp"])
 
     def get_hypothesis(self, hypothesis_id: str) -> Optional[Dict[str, Any]]:
         """Get a hypothesis by ID."""
-        query = "SELECT * FROM hypotheses WHERE id = :id"
         with self.engine.connect() as conn:
-            result = conn.execute(text(query), {"id": hypothesis_id})
+            result = conn.execute(GET_HYPOTHESIS, {"id": hypothesis_id})
             row = result.fetchone()
             if row:
                 return dict(row._mapping)
         return None
 
+    def get_hypothesis_status(self, hypothesis_id: str) -> Optional[Dict[str, Any]]:
+        """Get a hypothesis's status, error and test results by ID."""
+        with self.engine.connect() as conn:
+            row = conn.execute(GET_HYPOTHESIS_STATUS, {"id": hypothesis_id}).fetchone()
+            if row:
+                return dict(row._mapping)
+        return None
+
+    def get_pending_hypotheses(self) -> Iterator[Dict[str, Any]]:
+        """Stream pending hypotheses, grouped by asset, event type and lookback.
+
+        Rows come through a server-side cursor a few hundred at a time, so
+        the first group can start running before the rest are fetched.
+        """
+        with self.engine.connect() as conn:
+            conn = conn.execution_options(stream_results=True, yield_per=256)
+            for row in conn.execute(GET_PENDING_HYPOTHESES).mappings():
+                yield dict(row)
+
     def update_hypothesis_results(
         self,
         hypothesis_id: str,
@@ -91,42 +249,49 @@ class Database:
         test_results: Dict[str, Any],
     ) -> None:
         """Update hypothesis with test results."""
-        query = """
-            UPDATE hypotheses
-            SET status = 'completed',
-                p_value = :p_value,
-                hit_rate = :hit_rate,
-                edge = :edge,
-                sample_size = :sample_size,
-                test_results = :test_results,
-                tested_at = NOW()
-            WHERE id = :id
-        """
         with self.engine.connect() as conn:
             conn.execute(
-                text(query),
+                UPDATE_HYPOTHESIS_RESULTS,
                 {
                     "id": hypothesis_id,
                     "p_value": p_value,
                     "hit_rate": hit_rate,
                     "edge": edge,
                     "sample_size": sample_size,
-                    "test_results": str(test_results),
+                    "test_results": test_results,
                 },
             )
             conn.commit()
 
+    def bulk_update_hypothesis_results(self, updates: List[Dict[str, Any]]) -> None:
+        """Update many hypotheses with test results in one transaction.
+
+        Each item holds update_hypothesis_results' keyword arguments. The
+        rows go out as a single executemany, which psycopg pipelines rather
+        than waiting on a round trip per row.
+        """
+        if not updates:
+            return
+
+        params = [
+            {
+                "id": update["hypothesis_id"],
+                "p_value": update["p_value"],
+                "hit_rate": update["hit_rate"],
+                "edge": update["edge"],
+                "sample_size": update["sample_size"],
+                "test_results": update["test_results"],
+            }
+            for update in updates
+        ]
+        with self.engine.connect() as conn:
+            conn.execute(UPDATE_HYPOTHESIS_RESULTS, params)
+            conn.commit()
+
     def mark_hypothesis_failed(self, hypothesis_id: str, error: str) -> None:
         """Mark hypothesis as failed."""
-        query = """
-            UPDATE hypotheses
-            SET status = 'failed',
-                error_message = :error,
-                tested_at = NOW()
-            WHERE id = :id
-        """
         with self.engine.connect() as conn:
-            conn.execute(text(query), {"id": hypothesis_id, "error": error})
+            conn.execute(MARK_HYPOTHESIS_FAILED, {"id": hypothesis_id, "error": error})
             conn.commit()
 
     def create_relationship(
@@ -142,18 +307,9 @@ class Database:
         is_significant: bool,
     ) -> str:
         """Create a new relationship."""
-        query = """
-            INSERT INTO relationships
-            (event_type, market_asset, hit_rate, edge, p_value, sample_size,
-             description, metadata, is_significant)
-            VALUES
-            (:event_type, :market_asset, :hit_rate, :edge, :p_value, :sample_size,
-             :description, :metadata, :is_significant)
-            RETURNING id
-        """
         with self.engine.connect() as conn:
             result = conn.execute(
-                text(query),
+                CREATE_RELATIONSHIP,
                 {
                     "event_type": event_type,
                     "market_asset": market_asset,
@@ -162,10 +318,10 @@ class Database:
                     "p_value": p_value,
                     "sample_size": sample_size,
                     "description": description,
-                    "metadata": str(metadata),
+                    "metadata": metadata,
                     "is_significant": is_significant,
                 },
             )
             conn.commit()
             row = result.fetchone()
-            return str(row[0]) if row else ""
+            return row[0] if row else ""
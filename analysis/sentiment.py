@@ -1,58 +1,314 @@
 """Sentiment analysis using FinBERT."""
 
+import functools
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
 from typing import List, Dict, Any, Optional
 import torch
 from transformers import AutoTokenizer, AutoModelForSequenceClassification
 import numpy as np
+from scipy.special import softmax
 
 from config import Config
 
+# FinBERT labels: positive, negative, neutral
+LABELS = ["positive", "negative", "neutral"]
+
+# Characters kept before tokenizing: comfortably more than 512 tokens of
+# English (~4-5 chars/token), so truncation=True still decides the cut
+MAX_CHARS = 4000
+
+DTYPES = {"fp32": torch.float32, "fp16": torch.float16, "bf16": torch.bfloat16}
+
 
 class SentimentAnalyzer:
     """FinBERT-based sentiment analysis for financial text."""
 
-    def __init__(self, model_name: Optional[str] = None):
+    def __init__(self, model_name: Optional[str] = None, backend: Optional[str] = None):
         self.model_name = model_name or Config.SENTIMENT_MODEL
-        self.device = "cuda" if Config.USE_GPU and torch.cuda.is_available() else "cpu"
+        self.backend = backend or Config.SENTIMENT_BACKEND
+        if self.backend not in ("torch", "onnx"):
+            raise ValueError(f"Unknown sentiment backend: {self.backend}")
+
+        # The ONNX export is quantized for CPU execution only
+        use_gpu = Config.USE_GPU and self.backend == "torch"
+        self.device = "cuda" if use_gpu and torch.cuda.is_available() else "cpu"
+
+        # Half precision uses tensor cores on GPU; bf16 needs AMX/AVX512-BF16 on CPU
+        dtype = Config.SENTIMENT_DTYPE
+        if dtype == "auto":
+            dtype = "fp16" if self.device == "cuda" else "fp32"
+
+        # int8 loads in fp32, then quantizes the Linear layers; CPU kernels only
+        self.quantize = dtype == "int8"
+        if self.quantize:
+            if self.device != "cpu":
+                raise ValueError("int8 sentiment dtype is only supported on CPU")
+            dtype = "fp32"
+
+        if dtype not in DTYPES:
+            raise ValueError(f"Unknown sentiment dtype: {dtype}")
+        self.dtype = DTYPES[dtype]
 
         self._tokenizer = None
         self._model = None
+        self._session = None
+        # Reentrant: the compile warmup loads the tokenizer while holding it
+        self._load_lock = threading.RLock()
+
+        # LRU of text hash -> class probabilities; news feeds replay headlines
+        self.cache_size = Config.SENTIMENT_CACHE_SIZE
+        self._cache: "OrderedDict[int, np.ndarray]" = OrderedDict()
+        self._cache_lock = threading.Lock()
 
     @property
     def tokenizer(self):
         if self._tokenizer is None:
-            self._tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+            with self._load_lock:
+                if self._tokenizer is None:
+                    # Batch encoding in the Rust tokenizer runs across threads
+                    os.environ.setdefault("TOKENIZERS_PARALLELISM", "true")
+                    self._tokenizer = AutoTokenizer.from_pretrained(
+                        self.model_name, use_fast=True, cache_dir=Config.MODEL_CACHE_DIR
+                    )
         return self._tokenizer
 
     @property
     def model(self):
         if self._model is None:
-            self._model = AutoModelForSequenceClassification.from_pretrained(
-                self.model_name
-            ).to(self.device)
-            self._model.eval()
+            with self._load_lock:
+                if self._model is None:
+                    self._load_model()
         return self._model
 
-    def analyze(self, text: str) -> Dict[str, Any]:
-        """Analyze sentiment of a single text."""
-        inputs = self.tokenizer(
-            text,
+    def _load_model(self) -> None:
+        # SDPA routes attention through fused (FlashAttention-style) kernels
+        # low_cpu_mem_usage loads safetensors weights straight into place
+        # instead of materializing a randomly initialized copy first
+        model = AutoModelForSequenceClassification.from_pretrained(
+            self.model_name,
+            attn_implementation="sdpa",
+            torch_dtype=self.dtype,
+            low_cpu_mem_usage=True,
+            cache_dir=Config.MODEL_CACHE_DIR,
+        ).to(self.device)
+        model.eval()
+
+        if self.quantize:
+            # Int8 weights with activations quantized per batch; the default
+            # x86 engine dispatches to VNNI/AMX kernels where available
+            model = torch.ao.quantization.quantize_dynamic(
+                model, {torch.nn.Linear}, dtype=torch.qint8
+            )
+
+        if self.device == "cpu" and self.dtype == torch.bfloat16:
+            try:
+                import intel_extension_for_pytorch as ipex
+
+                model = ipex.optimize(model, dtype=torch.bfloat16)
+            except ImportError:
+                pass
+
+        if Config.TORCH_COMPILE:
+            # CUDA graphs remove per-op launch overhead; CPU uses the default mode
+            mode = "reduce-overhead" if self.device == "cuda" else "default"
+            model = torch.compile(model, mode=mode, dynamic=True)
+
+        # Publish only the finished model; other threads check _model unlocked
+        self._model = model
+        if Config.TORCH_COMPILE:
+            # Compile on load rather than inside the first request
+            self._predict(["warmup"], batch_size=1)
+
+    @property
+    def session(self):
+        """ONNX Runtime session over the fused, INT8-quantized export."""
+        if self._session is None:
+            with self._load_lock:
+                if self._session is None:
+                    import onnxruntime as ort
+
+                    options = ort.SessionOptions()
+                    options.enable_mem_pattern = True
+                    options.enable_cpu_mem_arena = True
+                    # Fusions were applied at export time; skip re-running them on load
+                    options.graph_optimization_level = (
+                        ort.GraphOptimizationLevel.ORT_ENABLE_BASIC
+                    )
+                    self._session = ort.InferenceSession(
+                        self._export_onnx(),
+                        sess_options=options,
+                        providers=["CPUExecutionProvider"],
+                    )
+        return self._session
+
+    def load(self) -> None:
+        """Load the tokenizer and model now rather than on first request."""
+        self.tokenizer
+        if self.backend == "onnx":
+            self.session
+        else:
+            self.model
+
+    def preload(self) -> None:
+        """Fetch model files before a forking server starts its workers.
+
+        Only a CPU torch model is built here. CUDA cannot be re-initialized in
+        a forked child, ONNX Runtime sessions are not fork-safe, and
+        torch.compile starts its own compile workers. Those backends are
+        fetched and exported now, then built in each worker on first use.
+        """
+        from huggingface_hub import snapshot_download
+
+        # Config, tokenizer and PyTorch weights; skip the TF/Flax copies
+        snapshot_download(
+            self.model_name,
+            cache_dir=Config.MODEL_CACHE_DIR,
+            allow_patterns=["*.json", "*.txt", "*.safetensors", "*.bin"],
+        )
+        if self.backend == "onnx":
+            self._export_onnx()
+        elif self.device == "cpu" and not Config.TORCH_COMPILE:
+            self.model
+
+    def _export_onnx(self) -> str:
+        """Export, fuse and quantize the model once; return the cached .onnx path."""
+        export_dir = os.path.join(Config.MODEL_CACHE_DIR, self.model_name.replace("/", "--"))
+        quantized_path = os.path.join(export_dir, "model.int8.onnx")
+        if os.path.exists(quantized_path):
+            return quantized_path
+
+        from optimum.onnxruntime import ORTModelForSequenceClassification
+        from onnxruntime.transformers.optimizer import optimize_model
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+
+        # Build in a private directory and move only the finished file into
+        # place, so concurrent processes never load a half-written model
+        os.makedirs(export_dir, exist_ok=True)
+        work_dir = tempfile.mkdtemp(dir=export_dir)
+        try:
+            ort_model = ORTModelForSequenceClassification.from_pretrained(
+                self.model_name, export=True, cache_dir=Config.MODEL_CACHE_DIR
+            )
+            ort_model.save_pretrained(work_dir)
+
+            # Fuse LayerNorm, GELU, attention and skip connections
+            optimized_path = os.path.join(work_dir, "model.opt.onnx")
+            optimized = optimize_model(
+                os.path.join(work_dir, "model.onnx"),
+                model_type="bert",
+                num_heads=ort_model.config.num_attention_heads,
+                hidden_size=ort_model.config.hidden_size,
+            )
+            optimized.save_model_to_file(optimized_path)
+
+            work_path = os.path.join(work_dir, "model.int8.onnx")
+            quantize_dynamic(optimized_path, work_path, weight_type=QuantType.QInt8)
+            os.replace(work_path, quantized_path)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        return quantized_path
+
+    def _forward(self, features: Dict[str, List[List[int]]]) -> np.ndarray:
+        """Pad a bucket of tokenized texts, run the model and return class probabilities."""
+        if self.backend == "onnx":
+            inputs = self.tokenizer.pad(features, padding="longest", return_tensors="np")
+            feed = {
+                node.name: inputs[node.name].astype(np.int64)
+                for node in self.session.get_inputs()
+            }
+            logits = self.session.run(None, feed)[0]
+            return softmax(logits, axis=-1)
+
+        # A compiled model caches one graph per shape, so round lengths up to 64
+        inputs = self.tokenizer.pad(
+            features,
+            padding="longest",
+            pad_to_multiple_of=64 if Config.TORCH_COMPILE else None,
             return_tensors="pt",
-            truncation=True,
-            max_length=512,
-            padding=True,
         ).to(self.device)
 
-        with torch.no_grad():
+        with torch.inference_mode():
             outputs = self.model(**inputs)
-            probs = torch.softmax(outputs.logits, dim=-1)
+            probs = torch.softmax(outputs.logits.float(), dim=-1)
 
-        # FinBERT labels: positive, negative, neutral
-        labels = ["positive", "negative", "neutral"]
-        scores = probs[0].cpu().numpy()
+        return probs.cpu().numpy()
 
+    def predict_proba(self, texts: List[str], batch_size: int = 32) -> np.ndarray:
+        """Return class probabilities for each text, in input order.
+
+        Texts seen recently, or repeated within the call, are served from the
+        LRU cache; only unseen texts go through the model.
+        """
+        keys = [hash(text) for text in texts]
+        rows: Dict[int, np.ndarray] = {}
+        misses: Dict[int, str] = {}
+
+        # The API calls in from several threads; the model runs outside the lock
+        with self._cache_lock:
+            for key, text in zip(keys, texts):
+                if key in rows or key in misses:
+                    continue
+                cached = self._cache.get(key)
+                if cached is None:
+                    misses[key] = text
+                else:
+                    self._cache.move_to_end(key)
+                    rows[key] = cached
+
+        if misses:
+            scores = self._predict(list(misses.values()), batch_size)
+            with self._cache_lock:
+                for key, row in zip(misses, scores):
+                    rows[key] = row
+                    self._cache[key] = row
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+
+        probs = np.empty((len(texts), len(LABELS)))
+        for i, key in enumerate(keys):
+            probs[i] = rows[key]
+        return probs
+
+    def _encode_batch(self, texts: List[str]) -> Dict[str, List[List[int]]]:
+        """Tokenize texts in one batched call, unpadded so batches can be bucketed."""
+        # Long articles would be tokenized in full only to be cut at 512 tokens
+        texts = [text[:MAX_CHARS] for text in texts]
+        return self.tokenizer(texts, padding=False, truncation=True, max_length=512)
+
+    def _predict(self, texts: List[str], batch_size: int) -> np.ndarray:
+        """Run texts through the model, batched by token length.
+
+        Texts are tokenized once and sorted by length, so each batch pads to
+        the longest text in its bucket rather than in an arbitrary slice.
+        """
+        probs = np.empty((len(texts), len(LABELS)))
+        encodings = self._encode_batch(texts)
+        order = np.argsort([len(ids) for ids in encodings["input_ids"]], kind="stable")
+
+        for i in range(0, len(order), batch_size):
+            bucket = order[i : i + batch_size]
+            features = {key: [values[j] for j in bucket] for key, values in encodings.items()}
+            # Scattering by bucket index restores the caller's order
+            probs[bucket] = self._forward(features)
+
+        return probs
+
+    def analyze(self, text: str) -> Dict[str, Any]:
+        """Analyze sentiment of a single text."""
+        return self.format_result(self.predict_proba([text])[0])
+
+    def analyze_batch(self, texts: List[str], batch_size: int = 32) -> List[Dict[str, Any]]:
+        """Analyze sentiment of multiple texts."""
+        return self.format_batch(texts, self.predict_proba(texts, batch_size))
+
+    def format_result(self, scores: np.ndarray) -> Dict[str, Any]:
+        """Build the single-text result from one row of class probabilities."""
         predicted_idx = np.argmax(scores)
-        predicted_label = labels[predicted_idx]
+        predicted_label = LABELS[predicted_idx]
         confidence = float(scores[predicted_idx])
 
         # Calculate sentiment score (-1 to 1)
@@ -62,49 +318,37 @@ class SentimentAnalyzer:
             "label": predicted_label,
             "confidence": confidence,
             "sentiment_score": sentiment_score,
-            "probabilities": {label: float(score) for label, score in zip(labels, scores)},
+            "probabilities": {label: float(score) for label, score in zip(LABELS, scores)},
         }
 
-    def analyze_batch(self, texts: List[str], batch_size: int = 32) -> List[Dict[str, Any]]:
-        """Analyze sentiment of multiple texts."""
-        results = []
-
-        for i in range(0, len(texts), batch_size):
-            batch = texts[i : i + batch_size]
-
-            inputs = self.tokenizer(
-                batch,
-                return_tensors="pt",
-                truncation=True,
-                max_length=512,
-                padding=True,
-            ).to(self.device)
-
-            with torch.no_grad():
-                outputs = self.model(**inputs)
-                probs = torch.softmax(outputs.logits, dim=-1)
-
-            labels = ["positive", "negative", "neutral"]
-
-            for j, scores in enumerate(probs):
-                scores = scores.cpu().numpy()
-                predicted_idx = np.argmax(scores)
-                predicted_label = labels[predicted_idx]
-                confidence = float(scores[predicted_idx])
-                sentiment_score = float(scores[0] - scores[1])
+    def format_batch(self, texts: List[str], probs: np.ndarray) -> List[Dict[str, Any]]:
+        """Build per-text results from an [N, 3] block of class probabilities."""
+        # Classify the whole block at once instead of row by row
+        predicted_idx = probs.argmax(axis=1)
+        confidence = probs[np.arange(len(probs)), predicted_idx]
+        sentiment_score = probs[:, 0] - probs[:, 1]
 
-                results.append({
-                    "text": batch[j][:100] + "..." if len(batch[j]) > 100 else batch[j],
-                    "label": predicted_label,
-                    "confidence": confidence,
-                    "sentiment_score": sentiment_score,
-                })
-
-        return results
+        return [
+            {
+                "text": text[:100] + "..." if len(text) > 100 else text,
+                "label": LABELS[idx],
+                "confidence": conf,
+                "sentiment_score": score,
+            }
+            for text, idx, conf, score in zip(
+                texts, predicted_idx.tolist(), confidence.tolist(), sentiment_score.tolist()
+            )
+        ]
 
     def aggregate_sentiment(self, texts: List[str]) -> Dict[str, Any]:
         """Get aggregate sentiment statistics for a list of texts."""
         if not texts:
+            return self.format_aggregate(np.empty((0, len(LABELS))))
+        return self.format_aggregate(self.predict_proba(texts))
+
+    def format_aggregate(self, probs: np.ndarray) -> Dict[str, Any]:
+        """Build aggregate statistics from an [N, 3] block of class probabilities."""
+        if not len(probs):
             return {
                 "mean_sentiment": 0.0,
                 "sentiment_std": 0.0,
@@ -114,16 +358,25 @@ class SentimentAnalyzer:
                 "count": 0,
             }
 
-        results = self.analyze_batch(texts)
-
-        sentiment_scores = [r["sentiment_score"] for r in results]
-        labels = [r["label"] for r in results]
+        # Work from the probability block directly; no per-text result dicts
+        sentiment_scores = probs[:, 0] - probs[:, 1]
+        label_ratios = np.bincount(probs.argmax(axis=1), minlength=len(LABELS)) / len(probs)
 
         return {
             "mean_sentiment": float(np.mean(sentiment_scores)),
             "sentiment_std": float(np.std(sentiment_scores)),
-            "positive_ratio": labels.count("positive") / len(labels),
-            "negative_ratio": labels.count("negative") / len(labels),
-            "neutral_ratio": labels.count("neutral") / len(labels),
-            "count": len(texts),
+            "positive_ratio": float(label_ratios[0]),
+            "negative_ratio": float(label_ratios[1]),
+            "neutral_ratio": float(label_ratios[2]),
+            "count": len(probs),
         }
+
+
+@functools.lru_cache(maxsize=1)
+def get_analyzer() -> SentimentAnalyzer:
+    """Process-wide analyzer, so the API and worker share one loaded model.
+
+    Pool processes forked after the model is loaded share its pages
+    copy-on-write instead of each loading their own copy.
+    """
+    return SentimentAnalyzer()
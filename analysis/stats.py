@@ -1,15 +1,94 @@
 """Statistical analysis functions."""
 
-from typing import Dict, Any, List, Tuple, Optional
+import hashlib
+from collections import OrderedDict
+from typing import Dict, Any, Tuple, Optional
 import numpy as np
 import pandas as pd
-from scipy import stats
-from scipy.stats import pearsonr, spearmanr, ttest_ind, mannwhitneyu
-from statsmodels.tsa.stattools import grangercausalitytests, adfuller
-from statsmodels.stats.multitest import multipletests
+from scipy import signal, special, stats
+from scipy.stats import ttest_ind, mannwhitneyu
+from statsmodels.tsa.stattools import adfuller
 
 from config import Config
 
+ADF_CACHE_SIZE = 256
+
+
+def _ols_rss(design: np.ndarray, target: np.ndarray) -> float:
+    """Residual sum of squares of a least-squares fit."""
+    coef, _, _, _ = np.linalg.lstsq(design, target, rcond=None)
+    resid = target - design @ coef
+    return float(resid @ resid)
+
+
+def _nested_rss(design: np.ndarray, target: np.ndarray, k: int) -> Tuple[float, float]:
+    """RSS of `target` regressed on the first `k` columns of `design`, and on all of them.
+
+    One QR of [design | target] gives both: the residual of a fit on the
+    leading columns is the tail of R's last column. Rank-deficient designs
+    fall back to two least-squares fits.
+    """
+    r = np.linalg.qr(np.column_stack([design, target]), mode="r")
+    diag = np.abs(np.diag(r)[: design.shape[1]])
+    if diag.min() <= diag.max() * max(design.shape) * np.finfo(np.float64).eps:
+        return _ols_rss(design[:, :k], target), _ols_rss(design, target)
+
+    tail = r[:, -1]
+    return float(tail[k:] @ tail[k:]), float(tail[-1] ** 2)
+
+
+def _copy_adf(summary: Dict[str, Any]) -> Dict[str, Any]:
+    """Copy a cached ADF summary, including its nested critical values."""
+    return {**summary, "critical_values": dict(summary["critical_values"])}
+
+
+def _timestamps_ns(column: pd.Series) -> np.ndarray:
+    """A timestamp column as datetime64[ns] (UTC for tz-aware data).
+
+    Columns the DB loader already parsed are used as-is; anything else is
+    parsed with pd.to_datetime.
+    """
+    if not pd.api.types.is_datetime64_any_dtype(column):
+        column = pd.to_datetime(column)
+    return column.values.astype("datetime64[ns]", copy=False)
+
+
+def _event_window_returns(
+    prices_ts: np.ndarray,
+    prices_ret: np.ndarray,
+    event_ts: np.ndarray,
+    pre_window: int,
+    post_window: int,
+) -> np.ndarray:
+    """Compounded return over each event's [t - pre, t + post] day window.
+
+    `prices_ts` must be sorted ascending. Windows containing no valid
+    (non-NaN) return are dropped.
+    """
+    # Window bounds by binary search over the sorted price timestamps
+    lo = np.searchsorted(prices_ts, event_ts - np.timedelta64(pre_window, "D"), side="left")
+    hi = np.searchsorted(prices_ts, event_ts + np.timedelta64(post_window, "D"), side="right")
+
+    valid = ~np.isnan(prices_ret)
+    returns = np.where(valid, prices_ret, 0.0)
+    valid_count = np.concatenate([[0], np.cumsum(valid)])
+
+    # log(1 + r) is undefined for zero or negative closes (and infinite after
+    # a zero close); left in the prefix sum it would poison every later window
+    bad = ~np.isfinite(returns) | (returns <= -1)
+    bad_count = np.concatenate([[0], np.cumsum(bad)])
+
+    # Prefix sums of log(1 + r) give every window's compounded return at once
+    log_growth = np.concatenate([[0.0], np.cumsum(np.log1p(np.where(bad, 0.0, returns)))])
+    window_returns = np.expm1(log_growth[hi] - log_growth[lo])
+
+    # Windows spanning a bad bar are compounded directly, as the product would be
+    for i in np.flatnonzero(bad_count[hi] > bad_count[lo]):
+        window_returns[i] = np.prod(1 + returns[lo[i] : hi[i]]) - 1
+
+    has_returns = valid_count[hi] - valid_count[lo] > 0
+    return window_returns[has_returns]
+
 
 class StatisticalAnalyzer:
     """Core statistical analysis engine."""
@@ -18,6 +97,8 @@ class StatisticalAnalyzer:
         self.significance_level = Config.SIGNIFICANCE_LEVEL
         self.min_sample_size = Config.MIN_SAMPLE_SIZE
         self.use_bonferroni = Config.BONFERRONI_CORRECTION
+        # Repeated screens of the same series skip the ADF regressions
+        self._adf_cache: "OrderedDict[Tuple, Dict[str, Any]]" = OrderedDict()
 
     def correlation_test(
         self, x: np.ndarray, y: np.ndarray, method: str = "pearson"
@@ -29,9 +110,10 @@ class StatisticalAnalyzer:
             raise ValueError(f"Need at least {self.min_sample_size} samples")
 
         if method == "pearson":
-            corr, p_value = pearsonr(x, y)
+            corr, p_value = self._fast_pearson(x, y)
         elif method == "spearman":
-            corr, p_value = spearmanr(x, y)
+            # Spearman is Pearson on ranks, with the same t-distribution p-value
+            corr, p_value = self._fast_pearson(stats.rankdata(x), stats.rankdata(y))
         else:
             raise ValueError(f"Unknown method: {method}")
 
@@ -43,6 +125,20 @@ class StatisticalAnalyzer:
             "method": method,
         }
 
+    def _fast_pearson(self, x: np.ndarray, y: np.ndarray) -> Tuple[float, float]:
+        """Pearson r and two-sided p-value, without pearsonr's validation overhead."""
+        xm = np.asarray(x, dtype=np.float64)
+        ym = np.asarray(y, dtype=np.float64)
+        xm = xm - xm.mean()
+        ym = ym - ym.mean()
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            r = np.clip((xm @ ym) / np.sqrt((xm @ xm) * (ym @ ym)), -1.0, 1.0)
+            df = len(xm) - 2
+            t = r * np.sqrt(df / ((1.0 - r) * (1.0 + r)))
+        p_value = 2 * special.stdtr(df, -np.abs(t))
+        return float(r), float(p_value)
+
     def granger_causality_test(
         self, x: np.ndarray, y: np.ndarray, max_lag: int = 5
     ) -> Dict[str, Any]:
@@ -52,18 +148,35 @@ class StatisticalAnalyzer:
         if len(x) < self.min_sample_size:
             raise ValueError(f"Need at least {self.min_sample_size} samples")
 
-        # Combine into DataFrame
-        data = pd.DataFrame({"x": x, "y": y})
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        n = len(y)
 
-        # Run Granger causality test
         try:
-            results = grangercausalitytests(data[["y", "x"]], maxlag=max_lag, verbose=False)
-
-            # Get minimum p-value across lags
+            # Build the lag matrices once; column k - 1 holds the series shifted by k
+            y_lags = np.zeros((n, max_lag))
+            x_lags = np.zeros((n, max_lag))
+            for k in range(1, max_lag + 1):
+                y_lags[k:, k - 1] = y[:-k]
+                x_lags[k:, k - 1] = x[:-k]
+            const = np.ones(n)
+
+            # SSR F-test per lag order, matching statsmodels' grangercausalitytests.
+            # The restricted model's columns lead the unrestricted design, so
+            # one factorization per lag yields both residual sums
             p_values = []
             for lag in range(1, max_lag + 1):
-                p_val = results[lag][0]["ssr_ftest"][1]
-                p_values.append(p_val)
+                target = y[lag:]
+                unrestricted = np.column_stack(
+                    [const[lag:], y_lags[lag:, :lag], x_lags[lag:, :lag]]
+                )
+                rss_restricted, rss_unrestricted = _nested_rss(unrestricted, target, lag + 1)
+                if rss_unrestricted <= 0:
+                    raise ValueError("Perfect fit; Granger test statistic is undefined")
+
+                df_resid = len(target) - unrestricted.shape[1]
+                f_stat = (rss_restricted - rss_unrestricted) / rss_unrestricted / lag * df_resid
+                p_values.append(float(stats.f.sf(f_stat, lag, df_resid)))
 
             min_p = min(p_values)
             best_lag = p_values.index(min_p) + 1
@@ -93,30 +206,28 @@ class StatisticalAnalyzer:
         if len(events) < self.min_sample_size:
             raise ValueError(f"Need at least {self.min_sample_size} events")
 
-        # Calculate returns
-        prices = prices.sort_values("timestamp")
-        prices["return"] = prices["close"].pct_change()
+        # Pull contiguous columns out once; everything below is plain NumPy
+        prices_ts = _timestamps_ns(prices["timestamp"])
+        prices_close = prices["close"].to_numpy(dtype=np.float64, na_value=np.nan)
+        event_ts = _timestamps_ns(events["timestamp"])
 
-        # Align events with prices
-        results = []
-        for _, event in events.iterrows():
-            event_date = pd.to_datetime(event["timestamp"])
+        # Rows normally arrive ORDER BY timestamp; only reorder when they don't
+        if np.any(prices_ts[1:] < prices_ts[:-1]):
+            order = np.argsort(prices_ts, kind="stable")
+            prices_ts, prices_close = prices_ts[order], prices_close[order]
 
-            # Get returns around event
-            mask = (prices["timestamp"] >= event_date - pd.Timedelta(days=pre_window)) & (
-                prices["timestamp"] <= event_date + pd.Timedelta(days=post_window)
-            )
-            window_returns = prices.loc[mask, "return"].dropna()
+        # Calculate returns
+        # Written in place so no full-length temporaries are allocated
+        prices_ret = np.empty_like(prices_close)
+        prices_ret[:1] = np.nan
+        np.divide(prices_close[1:], prices_close[:-1], out=prices_ret[1:])
+        prices_ret[1:] -= 1
 
-            if len(window_returns) > 0:
-                cumulative_return = (1 + window_returns).prod() - 1
-                results.append(cumulative_return)
+        results = _event_window_returns(prices_ts, prices_ret, event_ts, pre_window, post_window)
 
         if len(results) < self.min_sample_size:
             raise ValueError(f"Only {len(results)} valid event windows found")
 
-        results = np.array(results)
-
         # Calculate statistics
         mean_return = np.mean(results)
         std_return = np.std(results)
@@ -148,21 +259,38 @@ class StatisticalAnalyzer:
         if len(x) != len(y):
             raise ValueError("Arrays must have same length")
 
-        correlations = {}
-        for lag in range(-max_lag, max_lag + 1):
-            if lag < 0:
-                x_shifted = x[-lag:]
-                y_shifted = y[:lag]
-            elif lag > 0:
-                x_shifted = x[:-lag]
-                y_shifted = y[lag:]
-            else:
-                x_shifted = x
-                y_shifted = y
-
-            if len(x_shifted) >= self.min_sample_size:
-                corr, _ = pearsonr(x_shifted, y_shifted)
-                correlations[lag] = float(corr)
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        n = len(x)
+
+        lags = np.arange(-max_lag, max_lag + 1)
+        overlap = n - np.abs(lags)
+        keep = overlap >= self.min_sample_size
+        lags, overlap = lags[keep], overlap[keep]
+
+        # Pearson is shift-invariant; centering keeps the sums well conditioned
+        xc = x - x.mean()
+        yc = y - y.mean()
+
+        # One cross-correlation gives sum(x[i] * y[i + lag]) for every lag
+        cross = signal.correlate(yc, xc, mode="full")[lags + n - 1]
+
+        # Prefix sums give each lag's overlapping-segment moments in O(1)
+        px = np.concatenate([[0.0], np.cumsum(xc)])
+        pxx = np.concatenate([[0.0], np.cumsum(xc * xc)])
+        py = np.concatenate([[0.0], np.cumsum(yc)])
+        pyy = np.concatenate([[0.0], np.cumsum(yc * yc)])
+        x_lo, x_hi = np.maximum(0, -lags), n - np.maximum(0, lags)
+        y_lo, y_hi = np.maximum(0, lags), n - np.maximum(0, -lags)
+
+        sx, sxx = px[x_hi] - px[x_lo], pxx[x_hi] - pxx[x_lo]
+        sy, syy = py[y_hi] - py[y_lo], pyy[y_hi] - pyy[y_lo]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            corr = (overlap * cross - sx * sy) / np.sqrt(
+                (overlap * sxx - sx * sx) * (overlap * syy - sy * sy)
+            )
+
+        correlations = dict(zip(lags.tolist(), corr.tolist()))
 
         if not correlations:
             raise ValueError("Not enough data for lead/lag analysis")
@@ -182,24 +310,45 @@ class StatisticalAnalyzer:
         }
 
     def apply_bonferroni(
-        self, p_values: List[float], alpha: float = 0.05
+        self, p_values: np.ndarray, alpha: float = 0.05
     ) -> Dict[str, Any]:
-        """Apply Bonferroni correction to multiple p-values."""
-        reject, corrected_p, _, _ = multipletests(p_values, alpha=alpha, method="bonferroni")
+        """Apply Bonferroni correction to multiple p-values.
+
+        Arrays come back as NumPy arrays; callers that serialize the result
+        are responsible for converting them.
+        """
+        p_values = np.asarray(p_values, dtype=np.float64)
+        n = len(p_values)
+
+        corrected_p = np.minimum(p_values * n, 1.0)
+        reject = p_values <= alpha / n
 
         return {
             "original_p_values": p_values,
-            "corrected_p_values": corrected_p.tolist(),
-            "reject_null": reject.tolist(),
-            "num_significant": int(sum(reject)),
-            "correction_factor": len(p_values),
+            "corrected_p_values": corrected_p,
+            "reject_null": reject,
+            "num_significant": int(np.count_nonzero(reject)),
+            "correction_factor": n,
         }
 
-    def stationarity_test(self, x: np.ndarray) -> Dict[str, Any]:
-        """Test if series is stationary using ADF test."""
-        result = adfuller(x, autolag="AIC")
+    def stationarity_test(
+        self, x: np.ndarray, max_lag: Optional[int] = None, autolag: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """Test if series is stationary using ADF test.
 
-        return {
+        By default runs a single regression at Schwert's lag,
+        12 * (n / 100) ** 0.25; pass autolag="AIC" to search over lags instead.
+        """
+        x = np.ascontiguousarray(x, dtype=np.float64)
+        key = (hashlib.blake2b(x.tobytes(), digest_size=16).digest(), max_lag, autolag)
+        cached = self._adf_cache.get(key)
+        if cached is not None:
+            self._adf_cache.move_to_end(key)
+            return _copy_adf(cached)
+
+        result = adfuller(x, maxlag=max_lag, autolag=autolag)
+
+        summary = {
             "adf_statistic": float(result[0]),
             "p_value": float(result[1]),
             "used_lag": int(result[2]),
@@ -207,3 +356,8 @@ class StatisticalAnalyzer:
             "critical_values": {k: float(v) for k, v in result[4].items()},
             "is_stationary": result[1] < self.significance_level,
         }
+
+        self._adf_cache[key] = summary
+        if len(self._adf_cache) > ADF_CACHE_SIZE:
+            self._adf_cache.popitem(last=False)
+        return _copy_adf(summary)
@@ -1,35 +1,104 @@
 """Hypothesis testing worker."""
 
+import itertools
 import logging
-from typing import Dict, Any, Optional
-from datetime import datetime, timedelta
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Any, List, Optional, Tuple
+from datetime import datetime, timedelta, timezone
 import pandas as pd
 import numpy as np
 
 from database import Database
 from stats import StatisticalAnalyzer
-from sentiment import SentimentAnalyzer
 from config import Config
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
+# Tests that only need per-day event and price rows, which Postgres aggregates
+DAILY_TESTS = ("correlation", "granger_causality")
+
+
+def _data_key(hypothesis: Dict[str, Any]) -> Tuple[str, str, int]:
+    """The (event_type, market_asset, lookback_days) a hypothesis loads data for."""
+    return (
+        hypothesis["event_type"],
+        hypothesis["market_asset"],
+        hypothesis.get("lookback_days", 365),
+    )
+
+
+def _c64(column: pd.Series) -> np.ndarray:
+    """A column as a contiguous float64 array, copying only if it is not one already."""
+    return np.ascontiguousarray(column.to_numpy(dtype=np.float64, na_value=np.nan))
+
+
+def _day_numbers(dates: pd.Series) -> np.ndarray:
+    """Dates as int64 days since the epoch."""
+    return dates.to_numpy().astype("datetime64[D]").view(np.int64)
+
+
+def _daily_returns(market_data: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray]:
+    """Close-to-close returns as (day numbers, returns).
+
+    Daily closes come back non-null, so the only undefined return is the
+    first day's, which is sliced off rather than produced and dropped.
+    """
+    closes = _c64(market_data["close"])
+    returns = np.divide(closes[1:], closes[:-1])
+    returns -= 1
+    return _day_numbers(market_data["date"])[1:], returns
+
+
+def _align_days(event_days: np.ndarray, return_days: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Row indices into each side for the days both have, in date order."""
+    _, event_rows, return_rows = np.intersect1d(
+        event_days, return_days, assume_unique=True, return_indices=True
+    )
+    return event_rows, return_rows
+
+
+def _results_row(hypothesis_id: str, results: Dict[str, Any]) -> Dict[str, Any]:
+    """update_hypothesis_results arguments for a finished test."""
+    return {
+        "hypothesis_id": hypothesis_id,
+        "p_value": results["p_value"],
+        "hit_rate": results.get("hit_rate", 0.5),
+        "edge": results.get("edge", 0),
+        "sample_size": results["sample_size"],
+        "test_results": results,
+    }
+
+
+def _hit_rate(x: np.ndarray, y: np.ndarray) -> float:
+    """Share of days where an above-median x coincides with a positive y."""
+    # np.median selects with a partition, not a full sort
+    hits = np.greater(x, np.median(x))
+    np.equal(hits, y > 0, out=hits)
+    return float(np.count_nonzero(hits) / len(hits))
+
+
 class HypothesisWorker:
     """Worker that runs statistical tests on hypotheses."""
 
     def __init__(self):
         self.db = Database()
         self.stats = StatisticalAnalyzer()
-        self._sentiment = None
+
+        # (asset, group_by_day) -> (start, end, rows) of the widest range
+        # loaded during a run_all_pending call
+        self._market_cache: Dict[Tuple[str, bool], Tuple[datetime, datetime, pd.DataFrame]] = {}
 
     @property
     def sentiment(self):
-        """Lazy load sentiment analyzer (heavy model)."""
-        if self._sentiment is None:
-            logger.info("Loading FinBERT model...")
-            self._sentiment = SentimentAnalyzer()
-        return self._sentiment
+        """Shared sentiment analyzer; the model itself loads on first use."""
+        # Imported here so workers that never score text skip torch/transformers
+        from sentiment import get_analyzer
+
+        return get_analyzer()
 
     def run_hypothesis(self, hypothesis_id: str) -> Dict[str, Any]:
         """Run a single hypothesis test."""
@@ -40,123 +109,204 @@ class HypothesisWorker:
         if not hypothesis:
             raise ValueError(f"Hypothesis not found: {hypothesis_id}")
 
-        event_type = hypothesis["event_type"]
-        market_asset = hypothesis["market_asset"]
-        test_type = hypothesis["test_type"]
-        lookback_days = hypothesis.get("lookback_days", 365)
+        try:
+            events, market_data = self._fetch_data(
+                *_data_key(hypothesis),
+                group_by_day=hypothesis["test_type"] in DAILY_TESTS,
+            )
+            return self._dispatch(hypothesis, events, market_data)
+        except Exception as e:
+            self._mark_failed(hypothesis_id, e)
+            raise
 
-        # Get data
-        end_date = datetime.now()
+    def _fetch_data(
+        self,
+        event_type: str,
+        market_asset: str,
+        lookback_days: int,
+        group_by_day: bool = False,
+        end_date: Optional[datetime] = None,
+    ) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        """Load the events and prices a hypothesis is tested against.
+
+        With `group_by_day` both come back as one row per date (see DAILY_TESTS).
+        A run passes one fixed `end_date` to every group, which lets market
+        data be served from the run's cache.
+        """
+        cached = end_date is not None
+        if end_date is None:
+            end_date = datetime.now(timezone.utc)
         start_date = end_date - timedelta(days=lookback_days)
-
-        try:
-            events = self.db.get_events(
-                event_type=event_type,
-                start_date=start_date,
-                end_date=end_date,
+        if group_by_day:
+            # Whole UTC days, so fresh and cached daily loads return the same rows
+            start_date = start_date.astimezone(timezone.utc).replace(
+                hour=0, minute=0, second=0, microsecond=0
             )
 
+        events = self.db.get_events(
+            event_type=event_type,
+            start_date=start_date,
+            end_date=end_date,
+            group_by_day=group_by_day,
+        )
+
+        if cached:
+            market_data = self._get_market_data_cached(
+                market_asset, start_date, end_date, group_by_day
+            )
+        else:
             market_data = self.db.get_market_data(
                 asset=market_asset,
                 start_date=start_date,
                 end_date=end_date,
+                group_by_day=group_by_day,
             )
 
-            if len(events) < Config.MIN_SAMPLE_SIZE:
-                raise ValueError(f"Not enough events: {len(events)}")
-            if len(market_data) < Config.MIN_SAMPLE_SIZE:
-                raise ValueError(f"Not enough market data: {len(market_data)}")
-
-            # Run appropriate test
-            if test_type == "correlation":
-                results = self._run_correlation_test(events, market_data)
-            elif test_type == "granger_causality":
-                results = self._run_granger_test(events, market_data)
-            elif test_type == "event_study":
-                results = self._run_event_study(events, market_data)
-            else:
-                raise ValueError(f"Unknown test type: {test_type}")
-
-            # Update hypothesis with results
-            self.db.update_hypothesis_results(
-                hypothesis_id=hypothesis_id,
-                p_value=results["p_value"],
-                hit_rate=results.get("hit_rate", 0.5),
-                edge=results.get("edge", 0),
-                sample_size=results["sample_size"],
-                test_results=results,
+        return events, market_data
+
+    def _get_market_data_cached(
+        self, asset: str, start_date: datetime, end_date: datetime, group_by_day: bool
+    ) -> pd.DataFrame:
+        """get_market_data, sliced from the widest range already loaded for the asset.
+
+        Hypotheses on one asset with different event types or lookbacks then
+        share a single load.
+        """
+        key = (asset, group_by_day)
+        cached = self._market_cache.get(key)
+        if cached is None or cached[0] > start_date or cached[1] < end_date:
+            # Load the union with what is cached so the entry only ever widens
+            fetch_start, fetch_end = start_date, end_date
+            if cached is not None:
+                fetch_start, fetch_end = min(start_date, cached[0]), max(end_date, cached[1])
+            df = self.db.get_market_data(
+                asset=asset,
+                start_date=fetch_start,
+                end_date=fetch_end,
+                group_by_day=group_by_day,
             )
+            cached = self._market_cache[key] = (fetch_start, fetch_end, df)
+        df = cached[2]
+
+        # Rows are ordered by timestamp (or date), so the range is a slice.
+        # Daily loads start at UTC midnight (see _fetch_data), so slicing on
+        # whole dates matches what a fresh load would return.
+        if group_by_day:
+            column = df["date"]
+            lo, hi = pd.Timestamp(start_date.date()), pd.Timestamp(end_date.date())
+        else:
+            column = df["timestamp"]
+            lo, hi = pd.Timestamp(start_date), pd.Timestamp(end_date)
+        return df.iloc[column.searchsorted(lo) : column.searchsorted(hi, side="right")]
+
+    def _dispatch(
+        self,
+        hypothesis: Dict[str, Any],
+        events: pd.DataFrame,
+        market_data: pd.DataFrame,
+        completed: Optional[List[Tuple[Dict[str, Any], Dict[str, Any]]]] = None,
+    ) -> Dict[str, Any]:
+        """Run a hypothesis's test on already loaded data and store the results.
+
+        With `completed`, (hypothesis, results) is appended there instead, and
+        the caller stores it later with a bulk write (see _flush_results).
+        """
+        hypothesis_id = hypothesis["id"]
+        test_type = hypothesis["test_type"]
+
+        if len(events) < Config.MIN_SAMPLE_SIZE:
+            raise ValueError(f"Not enough events: {len(events)}")
+        if len(market_data) < Config.MIN_SAMPLE_SIZE:
+            raise ValueError(f"Not enough market data: {len(market_data)}")
+
+        # Run appropriate test
+        if test_type == "correlation":
+            results = self._run_correlation_test(events, market_data)
+        elif test_type == "granger_causality":
+            results = self._run_granger_test(events, market_data)
+        elif test_type == "event_study":
+            results = self._run_event_study(events, market_data)
+        else:
+            raise ValueError(f"Unknown test type: {test_type}")
+
+        if completed is None:
+            self._store_results(hypothesis, results)
+        else:
+            completed.append((hypothesis, results))
+
+        logger.info(f"Hypothesis {hypothesis_id} completed: p={results['p_value']:.4f}")
+        return results
+
+    def _store_results(
+        self, hypothesis: Dict[str, Any], results: Dict[str, Any], updated: bool = False
+    ) -> None:
+        """Write a hypothesis's results, then its relationship if significant.
 
-            # Create relationship if significant
-            if results["significant"]:
-                self._create_relationship(hypothesis, results)
+        `updated` skips the results row when a bulk write already stored it.
+        """
+        if not updated:
+            self.db.update_hypothesis_results(**_results_row(hypothesis["id"], results))
 
-            logger.info(f"Hypothesis {hypothesis_id} completed: p={results['p_value']:.4f}")
-            return results
+        # Create relationship if significant
+        if results["significant"]:
+            self._create_relationship(hypothesis, results)
 
+    def _mark_failed(self, hypothesis_id: str, error: Exception) -> None:
+        logger.error(f"Hypothesis {hypothesis_id} failed: {error}")
+        try:
+            self.db.mark_hypothesis_failed(hypothesis_id, str(error))
         except Exception as e:
-            logger.error(f"Hypothesis {hypothesis_id} failed: {e}")
-            self.db.mark_hypothesis_failed(hypothesis_id, str(e))
-            raise
+            # The row stays pending for the next run; callers still report the
+            # original failure rather than aborting the rest of the batch
+            logger.error(f"Could not mark hypothesis {hypothesis_id} failed: {e}")
 
     def _run_correlation_test(
         self, events: pd.DataFrame, market_data: pd.DataFrame
     ) -> Dict[str, Any]:
-        """Run correlation analysis."""
-        # Aggregate events to daily counts/values
-        events["date"] = pd.to_datetime(events["timestamp"]).dt.date
-        daily_events = events.groupby("date").agg(
-            {"value": "mean", "id": "count"}
-        ).rename(columns={"id": "count"})
+        """Run correlation analysis on daily event and price rows."""
+        # Correlate on event value over the days that carry one; when no
+        # event carries a value, fall back to event count over every day
+        value = _c64(events["value"])
+        has_value = ~np.isnan(value)
+        if has_value.any():
+            x_all = value[has_value]
+            event_days = _day_numbers(events["date"])[has_value]
+        else:
+            x_all = _c64(events["count"])
+            event_days = _day_numbers(events["date"])
 
         # Align with market data
-        market_data["date"] = pd.to_datetime(market_data["timestamp"]).dt.date
-        daily_prices = market_data.groupby("date").agg({"close": "last"})
-        daily_prices["return"] = daily_prices["close"].pct_change()
-
-        # Merge
-        merged = daily_events.join(daily_prices, how="inner")
-        merged = merged.dropna()
+        return_days, returns = _daily_returns(market_data)
+        event_rows, return_rows = _align_days(event_days, return_days)
 
-        if len(merged) < Config.MIN_SAMPLE_SIZE:
-            raise ValueError(f"Not enough aligned data: {len(merged)}")
+        if len(event_rows) < Config.MIN_SAMPLE_SIZE:
+            raise ValueError(f"Not enough aligned data: {len(event_rows)}")
 
-        # Use event count or value
-        x = merged["count"].values if merged["value"].isna().all() else merged["value"].values
-        y = merged["return"].values
+        x = x_all[event_rows]
+        y = returns[return_rows]
 
         result = self.stats.correlation_test(x, y)
 
         # Calculate hit rate (positive correlation = positive return)
-        hit_rate = np.mean((x > np.median(x)) == (y > 0))
-        result["hit_rate"] = float(hit_rate)
+        result["hit_rate"] = _hit_rate(x, y)
 
         return result
 
     def _run_granger_test(
         self, events: pd.DataFrame, market_data: pd.DataFrame
     ) -> Dict[str, Any]:
-        """Run Granger causality test."""
-        # Aggregate events to daily
-        events["date"] = pd.to_datetime(events["timestamp"]).dt.date
-        daily_events = events.groupby("date").agg({"id": "count"}).rename(columns={"id": "count"})
-
-        # Daily returns
-        market_data["date"] = pd.to_datetime(market_data["timestamp"]).dt.date
-        daily_prices = market_data.groupby("date").agg({"close": "last"})
-        daily_prices["return"] = daily_prices["close"].pct_change()
-
-        # Merge and align
-        merged = daily_events.join(daily_prices, how="inner").dropna()
+        """Run Granger causality test on daily event and price rows."""
+        return_days, returns = _daily_returns(market_data)
+        event_rows, return_rows = _align_days(_day_numbers(events["date"]), return_days)
 
-        if len(merged) < Config.MIN_SAMPLE_SIZE:
-            raise ValueError(f"Not enough aligned data: {len(merged)}")
+        if len(event_rows) < Config.MIN_SAMPLE_SIZE:
+            raise ValueError(f"Not enough aligned data: {len(event_rows)}")
 
-        x = merged["count"].values
-        y = merged["return"].values
+        x = _c64(events["count"])[event_rows]
+        y = returns[return_rows]
 
         result = self.stats.granger_causality_test(x, y)
-        result["sample_size"] = len(merged)
+        result["sample_size"] = len(x)
 
         return result
 
@@ -197,28 +347,184 @@ class HypothesisWorker:
         )
         logger.info(f"Created relationship: {description}")
 
-    def run_all_pending(self) -> Dict[str, Any]:
-        """Run all pending hypotheses."""
-        # Get pending hypotheses from DB
-        query = "SELECT id FROM hypotheses WHERE status = 'pending' ORDER BY created_at ASC"
-
-        with self.db.engine.connect() as conn:
-            from sqlalchemy import text
-            result = conn.execute(text(query))
-            pending_ids = [row[0] for row in result]
+    def run_all_pending(self, max_workers: Optional[int] = None) -> Dict[str, Any]:
+        """Run all pending hypotheses.
 
+        Hypotheses sharing an event type, asset and lookback are tested
+        against one load of their events and prices. Assets run in parallel
+        across `max_workers` processes (default NUM_WORKERS); each asset's
+        groups stay in one process so they share its market data cache.
+        """
+        max_workers = max_workers or Config.NUM_WORKERS
+        groups = itertools.groupby(self.db.get_pending_hypotheses(), key=_data_key)
         results = {"success": [], "failed": []}
 
-        for hypothesis_id in pending_ids:
+        # One clock for the whole run, so market data loaded for one group
+        # can be sliced for the next
+        end_date = datetime.now(timezone.utc)
+
+        # Results are written from here in batches rather than per hypothesis
+        completed: List[Tuple[Dict[str, Any], Dict[str, Any]]] = []
+
+        if max_workers <= 1:
+            for key, group in groups:
+                self._collect_group(self._run_group(key, list(group), end_date), completed, results)
+        else:
+            # spawn rather than fork: a forked child would inherit this
+            # process's pooled DB connections, including the pending-rows cursor
+            pool = ProcessPoolExecutor(
+                max_workers=max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=init_process_worker,
+            )
+            # Pending rows arrive ordered by asset, so its groups are adjacent
+            assets = itertools.groupby(
+                ((key, list(group)) for key, group in groups), key=lambda item: item[0][1]
+            )
+            with pool:
+                futures = {}
+                for _, asset_groups in assets:
+                    asset_groups = list(asset_groups)
+                    futures[pool.submit(run_asset_job, asset_groups, end_date)] = asset_groups
+
+                for future in as_completed(futures):
+                    asset_groups = futures.pop(future)
+                    try:
+                        group_result = future.result()
+                    except Exception as e:
+                        # A dead pool process breaks every outstanding task,
+                        # most of which never ran; leave those rows pending
+                        # for the next run and only mark errors from the task
+                        mark = not isinstance(e, BrokenProcessPool)
+                        group_result = {"completed": [], "failed": []}
+                        for _, group in asset_groups:
+                            for hypothesis in group:
+                                if mark:
+                                    self._mark_failed(hypothesis["id"], e)
+                                group_result["failed"].append(
+                                    {"id": hypothesis["id"], "error": str(e)}
+                                )
+                    self._collect_group(group_result, completed, results)
+
+        self._flush_results(completed, results)
+
+        self._market_cache.clear()
+        return results
+
+    def _collect_group(
+        self,
+        group_result: Dict[str, Any],
+        completed: List[Tuple[Dict[str, Any], Dict[str, Any]]],
+        results: Dict[str, Any],
+    ) -> None:
+        """Buffer one group's outcome, flushing once a batch is full."""
+        results["failed"].extend(group_result["failed"])
+        completed.extend(group_result["completed"])
+        if len(completed) >= Config.RESULTS_BATCH_SIZE:
+            self._flush_results(completed, results)
+
+    def _flush_results(
+        self,
+        completed: List[Tuple[Dict[str, Any], Dict[str, Any]]],
+        results: Dict[str, Any],
+    ) -> None:
+        """Bulk-write buffered results and record the hypotheses as done or failed.
+
+        Relationships are only created once a hypothesis's row is stored. If
+        the batch write fails, its rows are retried one at a time so only the
+        bad ones fail.
+        """
+        if not completed:
+            return
+
+        try:
+            self.db.bulk_update_hypothesis_results(
+                [_results_row(hypothesis["id"], outcome) for hypothesis, outcome in completed]
+            )
+            updated = True
+        except Exception as e:
+            logger.error(f"Bulk write of {len(completed)} results failed, retrying one by one: {e}")
+            updated = False
+
+        for hypothesis, test_results in completed:
+            try:
+                self._store_results(hypothesis, test_results, updated=updated)
+                results["success"].append(hypothesis["id"])
+            except Exception as e:
+                self._mark_failed(hypothesis["id"], e)
+                results["failed"].append({"id": hypothesis["id"], "error": str(e)})
+        completed.clear()
+
+    def _run_group(
+        self, key: Tuple[str, str, int], group: List[Dict[str, Any]], end_date: datetime
+    ) -> Dict[str, Any]:
+        """Run hypotheses that share one (event_type, market_asset, lookback_days).
+
+        Completed (hypothesis, results) pairs are returned under "completed"
+        for the caller to bulk-write; failures are marked as they happen.
+        """
+        results = {"completed": [], "failed": []}
+        logger.info(f"Running {len(group)} hypotheses on {key[0]} / {key[1]}")
+
+        # Daily and raw rows are each loaded at most once for the group
+        frames: Dict[bool, Tuple[pd.DataFrame, pd.DataFrame]] = {}
+
+        for hypothesis in group:
+            hypothesis_id = hypothesis["id"]
+            daily = hypothesis["test_type"] in DAILY_TESTS
             try:
-                self.run_hypothesis(str(hypothesis_id))
-                results["success"].append(hypothesis_id)
+                if daily not in frames:
+                    frames[daily] = self._fetch_data(*key, group_by_day=daily, end_date=end_date)
+                self._dispatch(hypothesis, *frames[daily], completed=results["completed"])
             except Exception as e:
-                logger.error(f"Failed: {hypothesis_id}: {e}")
+                self._mark_failed(hypothesis_id, e)
                 results["failed"].append({"id": hypothesis_id, "error": str(e)})
 
         return results
 
+    def _run_asset(
+        self, groups: List[Tuple[Tuple[str, str, int], List[Dict[str, Any]]]], end_date: datetime
+    ) -> Dict[str, Any]:
+        """Run every pending group on one market asset, sharing its market data cache."""
+        results = {"completed": [], "failed": []}
+        for key, group in groups:
+            group_result = self._run_group(key, group, end_date)
+            results["completed"].extend(group_result["completed"])
+            results["failed"].extend(group_result["failed"])
+
+        self._market_cache.clear()
+        return results
+
+
+# One worker per pool process, built by the pool initializer so the DB engine
+# and any loaded models are reused across jobs
+_process_worker: Optional[HypothesisWorker] = None
+
+
+def init_process_worker() -> None:
+    """Process pool initializer."""
+    global _process_worker
+    _process_worker = HypothesisWorker()
+
+
+def run_hypothesis_job(hypothesis_id: str) -> Dict[str, Any]:
+    """Run a hypothesis on this process's worker."""
+    return _process_worker.run_hypothesis(hypothesis_id)
+
+
+def run_asset_job(
+    groups: List[Tuple[Tuple[str, str, int], List[Dict[str, Any]]]], end_date: datetime
+) -> Dict[str, Any]:
+    """Run one asset's groups of pending hypotheses on this process's worker."""
+    return _process_worker._run_asset(groups, end_date)
+
+
+def run_all_pending_job() -> Dict[str, Any]:
+    """Run all pending hypotheses on this process's worker."""
+    # Already inside the API's process pool; a nested pool here would run
+    # about twice as many processes as CPUs
+    return _process_worker.run_all_pending(max_workers=1)
+
 
 if __name__ == "__main__":
     worker = HypothesisWorker()